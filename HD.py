@@ -1,8 +1,13 @@
+# Requires streamlit>=1.31 (st.write_stream) and pandas>=2.0 with pyarrow (dtype_backend="pyarrow")
 import streamlit as st
+import altair as alt
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import requests
-import re
+import io
+import json
 
 # ----------------------------
 # PAGE CONFIG
@@ -21,6 +26,15 @@ This tool will let you:
 - Get **AI-powered campaign insights**
 """)
 
+# Row-level tables are capped in the browser; the full data is offered as a CSV download
+MAX_DISPLAY_ROWS = 5000
+
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(table: pd.DataFrame) -> bytes:
+    return table.to_csv(index=False).encode()
+
+
 # ----------------------------
 # FILE UPLOAD
 # ----------------------------
@@ -37,19 +51,8 @@ if not uploaded_files:
 # ----------------------------
 # DATA LOADING & CLEANING
 # ----------------------------
-all_dfs = []
-for file in uploaded_files:
-    try:
-        df = pd.read_csv(file, skiprows=2)  # Google Ads reports often have 2 metadata rows
-        df["account"] = file.name
-        all_dfs.append(df)
-    except Exception as e:
-        st.error(f"Error reading {file.name}: {e}")
-
-df = pd.concat(all_dfs, ignore_index=True)
-
-# Standardize column names
-df = df.rename(columns={
+# Google Ads export columns we use, and their standardized names
+REPORT_COLUMNS = {
     "Search term": "search_term",
     "Keyword": "keyword",
     "Campaign": "campaign",
@@ -58,13 +61,81 @@ df = df.rename(columns={
     "Interactions": "clicks",
     "Cost": "cost",
     "Match type": "match_type"
-})
+}
+
+
+@st.cache_data(show_spinner=False)
+def load_reports(file_bytes_tuple: tuple[tuple[str, bytes], ...]) -> pd.DataFrame:
+    """Parse, combine and clean the uploaded reports (cached on file contents)."""
+    all_dfs = []
+    for name, data in file_bytes_tuple:
+        try:
+            df = pd.read_csv(
+                io.BytesIO(data),
+                header=2,  # Google Ads reports have 2 metadata rows; the pyarrow engine ignores skiprows
+                engine="pyarrow",
+                dtype_backend="pyarrow",
+                usecols=list(REPORT_COLUMNS),
+                dtype={
+                    # Numbers are read as text and coerced below: exports may contain "1,234", "--" or totals rows
+                    "Impr.": "string[pyarrow]",
+                    "Interactions": "string[pyarrow]",
+                    "Cost": "string[pyarrow]",
+                    "Search term": "string[pyarrow]",
+                    "Keyword": "string[pyarrow]",
+                    "Campaign": "string[pyarrow]",
+                    "Ad group": "string[pyarrow]",
+                    "Match type": "string[pyarrow]"
+                }
+            )
+            # Standardize column names in place (rename() would copy every block)
+            df.columns = df.columns.map(REPORT_COLUMNS)
+            df["account"] = name
+            all_dfs.append(df)
+        except Exception as e:
+            st.error(f"Error reading {name}: {e}")
+
+    if not all_dfs:
+        st.error("None of the uploaded files could be read.")
+        st.stop()
+
+    df = pd.concat(all_dfs)
+    df.reset_index(drop=True, inplace=True)  # per-file indexes overlap; relabel in place
+
+    # Clean numbers (strip thousands separators; anything still non-numeric becomes 0)
+    for col in ["impressions", "clicks", "cost"]:
+        df[col] = pd.to_numeric(df[col].str.replace(",", "", regex=False), errors="coerce")
+
+    # Fill blanks; counts are downcast to halve the bytes aggregated below, cost stays float64 to avoid float32 rounding in totals
+    df["impressions"] = df["impressions"].fillna(0).astype("int32")
+    df["clicks"] = df["clicks"].fillna(0).astype("int32")
+    df["cost"] = df["cost"].fillna(0).astype("float64")
+
+    # Drop rows without a search term using Arrow's validity bitmap (take() avoids a chained-assignment copy flag)
+    has_term = np.asarray(pc.is_valid(pa.array(df["search_term"])))
+    df = df.take(np.flatnonzero(has_term))
+
+    # Rows without a keyword group under "" (a null would become a null MultiIndex level, which cache hashing rejects)
+    df["keyword"] = df["keyword"].fillna("")
+
+    # Normalize text once here so every filtered view inherits it (strip quotes/brackets from keywords)
+    df["search_term_clean"] = pd.arrays.ArrowExtensionArray(
+        pc.utf8_trim_whitespace(pc.utf8_lower(pa.array(df["search_term"])))
+    )
+    df["keyword_clean"] = pd.arrays.ArrowExtensionArray(
+        pc.utf8_lower(pc.utf8_trim_whitespace(pc.replace_substring_regex(
+            pa.array(df["keyword"]), pattern=r'[\[\]"]', replacement=""
+        )))
+    )
+
+    # Categorical keys let every groupby below work on integer codes
+    for c in ("account", "campaign", "ad_group", "keyword", "search_term", "match_type"):
+        df[c] = df[c].astype("category")
 
-# Clean numbers
-for col in ["impressions", "clicks", "cost"]:
-    df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    return df
 
-df = df.dropna(subset=["search_term"])
+
+df = load_reports(tuple((f.name, f.getvalue()) for f in uploaded_files))
 
 # ----------------------------
 # SIDEBAR FILTERS
@@ -75,7 +146,7 @@ accounts = df["account"].unique()
 account_sel = st.sidebar.selectbox("Select Account", ["All"] + list(accounts))
 filtered_df = df if account_sel == "All" else df[df["account"] == account_sel]
 
-campaigns = filtered_df["campaign"].unique()
+campaigns = filtered_df["campaign"].dropna().unique()
 campaign_sel = st.sidebar.selectbox("Select Campaign", ["All"] + list(campaigns))
 if campaign_sel != "All":
     filtered_df = filtered_df[filtered_df["campaign"] == campaign_sel]
@@ -85,19 +156,43 @@ if campaign_sel != "All":
 # ----------------------------
 st.subheader("📊 Keyword Summary")
 
-summary = (
-    filtered_df.groupby("keyword")
-    .agg(
-        total_search_terms=("search_term", "nunique"),
-        total_impressions=("impressions", "sum"),
-        total_clicks=("clicks", "sum"),
-        total_cost=("cost", "sum")
+@st.cache_data(show_spinner=False)
+def keyword_term_totals(filtered_df: pd.DataFrame) -> pd.DataFrame:
+    """Totals per (keyword, search_term) pair; every keyword/term view below is derived from this."""
+    return (
+        filtered_df.groupby(["keyword", "search_term"], observed=True, sort=False)
+        .agg(
+            impressions=("impressions", "sum"),
+            clicks=("clicks", "sum"),
+            cost=("cost", "sum")
+        )
     )
-    .reset_index()
-    .sort_values("total_search_terms", ascending=False)
-)
-summary["CTR"] = (summary["total_clicks"] / summary["total_impressions"]).fillna(0)
-summary["CPC"] = (summary["total_cost"] / summary["total_clicks"]).replace([float("inf")], 0)
+
+
+@st.cache_data(show_spinner=False)
+def keyword_summary(kw_term: pd.DataFrame) -> pd.DataFrame:
+    summary = (
+        kw_term.drop(index="", level="keyword", errors="ignore")  # rows with no keyword only feed the term views
+        .groupby(level="keyword", observed=True)
+        .agg(
+            total_search_terms=("impressions", "size"),
+            total_impressions=("impressions", "sum"),
+            total_clicks=("clicks", "sum"),
+            total_cost=("cost", "sum")
+        )
+        .reset_index()
+        .sort_values("total_search_terms", ascending=False)
+    )
+    imp = summary["total_impressions"].to_numpy(dtype=float)
+    clk = summary["total_clicks"].to_numpy(dtype=float)
+    cst = summary["total_cost"].to_numpy(dtype=float)
+    summary["CTR"] = np.divide(clk, imp, out=np.zeros_like(clk), where=imp > 0)
+    summary["CPC"] = np.divide(cst, clk, out=np.zeros_like(clk), where=clk > 0)
+    return summary
+
+
+kw_term = keyword_term_totals(filtered_df)
+summary = keyword_summary(kw_term)
 
 st.dataframe(summary, use_container_width=True)
 
@@ -106,20 +201,25 @@ st.dataframe(summary, use_container_width=True)
 # ----------------------------
 st.subheader("🔍 Exact Search Terms by Keyword")
 
+@st.cache_resource(show_spinner=False)
+def per_keyword_details(kw_term: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """Sorted search-term table for every keyword, so switching keywords is a dict lookup.
+
+    Cached as a shared resource: cache_data would unpickle a fresh copy of every table on each rerun.
+    The tables are only ever read.
+    """
+    return {
+        kw: group.droplevel("keyword").reset_index().sort_values("clicks", ascending=False)
+        for kw, group in kw_term.groupby(level="keyword", observed=True)
+    }
+
+
+details = per_keyword_details(kw_term)
+
 chosen_kw = st.selectbox("Pick a keyword to see its exact search terms:", summary["keyword"].dropna().tolist())
 
 if chosen_kw:
-    sub = filtered_df[filtered_df["keyword"] == chosen_kw]
-    term_details = (
-        sub.groupby("search_term")
-        .agg(
-            impressions=("impressions", "sum"),
-            clicks=("clicks", "sum"),
-            cost=("cost", "sum")
-        )
-        .reset_index()
-        .sort_values("clicks", ascending=False)
-    )
+    term_details = details[chosen_kw]
     st.write(f"**Keyword:** `{chosen_kw}` — {len(term_details)} unique search terms")
     st.dataframe(term_details, use_container_width=True)
 
@@ -128,17 +228,20 @@ if chosen_kw:
 # ----------------------------
 st.subheader("🔝 Top Search Terms by Clicks")
 top_terms = (
-    filtered_df.groupby("search_term")
+    kw_term.groupby(level="search_term", observed=True)
     .agg(clicks=("clicks", "sum"), impressions=("impressions", "sum"))
-    .sort_values(by="clicks", ascending=False)
-    .head(15)
+    .nlargest(15, "clicks")
 )
 
-fig, ax = plt.subplots(figsize=(10,6))
-top_terms.sort_values("clicks").plot.barh(y="clicks", ax=ax, legend=False, color="skyblue")
-ax.set_xlabel("Clicks")
-ax.set_ylabel("Search Term")
-st.pyplot(fig)
+st.altair_chart(
+    alt.Chart(top_terms.reset_index())
+    .mark_bar()
+    .encode(
+        x=alt.X("clicks:Q", title="Clicks"),
+        y=alt.Y("search_term:N", sort="-x", title="Search Term")  # keep bars ranked by clicks
+    ),
+    use_container_width=True
+)
 
 st.dataframe(top_terms, use_container_width=True)
 
@@ -147,28 +250,30 @@ st.dataframe(top_terms, use_container_width=True)
 # ----------------------------
 st.subheader("⚠️ Search Terms Not Covered by Keywords")
 
-# Normalize text (strip quotes/brackets from keywords)
-def clean_kw(text):
-    if pd.isna(text):
-        return ""
-    return re.sub(r'[\[\]\"]', '', str(text)).strip().lower()
-
-filtered_df["search_term_clean"] = filtered_df["search_term"].str.lower().str.strip()
-filtered_df["keyword_clean"] = filtered_df["keyword"].apply(clean_kw)
+@st.cache_data(show_spinner=False)
+def uncovered_search_terms(filtered_df: pd.DataFrame) -> pd.DataFrame:
+    """Rows whose search term matches none of the (non-blank) keywords, as the detail table, busiest first."""
+    kw_unique = pd.unique(filtered_df["keyword_clean"].values)
+    kw_unique = kw_unique[kw_unique != ""]
+    return (
+        filtered_df.loc[
+            ~filtered_df["search_term_clean"].isin(kw_unique),
+            ["search_term", "match_type", "campaign", "ad_group", 
+             "impressions", "clicks", "cost", "keyword"]
+        ]
+        .sort_values(by="clicks", ascending=False)
+    )
 
-# Global sets
-all_keywords = set(filtered_df["keyword_clean"].unique()) - {""}
-all_search_terms = set(filtered_df["search_term_clean"].unique())
-uncovered_terms = all_search_terms - all_keywords
 
-# Filter dataset for uncovered search terms
-uncovered_df = filtered_df[filtered_df["search_term_clean"].isin(uncovered_terms)].copy()
+uncovered_df = uncovered_search_terms(filtered_df)
 
-if uncovered_df.empty:
-    st.info("✅ All search terms are already covered by your paid keywords!")
-else:
-    uncovered_summary = (
-        uncovered_df.groupby("search_term")
+@st.cache_data(show_spinner=False)
+def uncovered_search_summary(kw_term: pd.DataFrame, uncovered_terms: pd.Series) -> pd.DataFrame:
+    """Roll up the cached (keyword, search_term) totals for the uncovered terms only."""
+    in_gap = kw_term.index.get_level_values("search_term").isin(uncovered_terms.unique())
+    return (
+        kw_term[in_gap]
+        .groupby(level="search_term", observed=True)
         .agg(
             total_impressions=("impressions", "sum"),
             total_clicks=("clicks", "sum"),
@@ -177,17 +282,23 @@ else:
         .reset_index()
         .sort_values(by=["total_clicks", "total_impressions"], ascending=[False, False])
     )
+
+
+if uncovered_df.empty:
+    st.info("✅ All search terms are already covered by your paid keywords!")
+else:
+    uncovered_summary = uncovered_search_summary(kw_term, uncovered_df["search_term"])
     st.write("These search terms drive traffic but are **not directly mapped to your keywords**:")
     st.markdown("### 📊 Aggregated Summary")
     st.dataframe(uncovered_summary, use_container_width=True)
 
     st.markdown("### 📋 Full Detailed List")
-    st.dataframe(
-        uncovered_df[
-            ["search_term", "match_type", "campaign", "ad_group", 
-             "impressions", "clicks", "cost", "keyword"]
-        ].sort_values(by="clicks", ascending=False),
-        use_container_width=True
+    st.dataframe(uncovered_df.head(MAX_DISPLAY_ROWS), use_container_width=True)
+    st.download_button(
+        "Download full uncovered list",
+        to_csv_bytes(uncovered_df),
+        "uncovered_search_terms.csv",
+        mime="text/csv"
     )
 
 # ----------------------------
@@ -195,20 +306,56 @@ else:
 # ----------------------------
 st.subheader("🔗 Search Term → Keyword Mapping")
 
-mapping = (
-    filtered_df[["search_term", "keyword", "impressions", "clicks", "cost"]]
-    .sort_values(by="clicks", ascending=False)
-    .reset_index(drop=True)
-)
+@st.cache_data(show_spinner=False)
+def search_term_mapping(filtered_df: pd.DataFrame) -> pd.DataFrame:
+    return (
+        filtered_df[["search_term", "keyword", "impressions", "clicks", "cost"]]
+        .sort_values(by="clicks", ascending=False)
+        .reset_index(drop=True)
+    )
+
+
+mapping = search_term_mapping(filtered_df)
 
 st.write("This table shows exactly **what people typed (Search Term)** and **which keyword triggered your ad**:")
-st.dataframe(mapping, use_container_width=True)
+st.dataframe(mapping.head(MAX_DISPLAY_ROWS), use_container_width=True)
+st.download_button("Download full mapping", to_csv_bytes(mapping), "mapping.csv", mime="text/csv")
 
 # ----------------------------
 # AI CAMPAIGN INSIGHTS
 # ----------------------------
 st.subheader("🤖 AI Campaign Insights")
 
+@st.cache_resource
+def openrouter_session() -> requests.Session:
+    """One pooled, pre-authenticated HTTP session per app process, so repeat clicks reuse the TLS connection."""
+    s = requests.Session()
+    s.headers.update({
+        "Authorization": f"Bearer {st.secrets['OPENROUTER_KEY']}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost",  # Replace with your app URL if deployed
+        "X-Title": "Google Ads Dashboard"
+    })
+    return s
+
+
+def stream_completion(response: requests.Response):
+    """Yield content deltas from an OpenRouter server-sent event stream."""
+    for raw in response.iter_lines():
+        line = raw.decode("utf-8")
+        if not line.startswith("data: "):
+            continue  # blank separators and ": keep-alive" comments
+        data = line[len("data: "):]
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        if "choices" not in chunk:
+            raise RuntimeError(chunk.get("error", chunk))
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
 if st.button("Generate AI Insights"):
     with st.spinner("⌛ Generating insights…"):
         try:
@@ -226,36 +373,25 @@ if st.button("Generate AI Insights"):
             Keep it simple, clear, and focused ONLY on this campaign.
             """
 
-            api_key = st.secrets["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"]
-
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "http://localhost",  # Replace with your app URL if deployed
-                "X-Title": "Google Ads Dashboard"
-            }
-
             payload = {
                 "model": "meta-llama/llama-3.3-70b-instruct:free",
                 "messages": [
                     {"role": "system", "content": "You are a marketing strategist AI."},
                     {"role": "user", "content": prompt}
                 ],
-                "max_tokens": 400
+                "max_tokens": 400,
+                "stream": True
             }
 
-            response = requests.post(
+            with openrouter_session().post(
                 "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload
-            )
-
-            result = response.json()
-
-            if "choices" in result:
-                st.success(result["choices"][0]["message"]["content"])
-            else:
-                st.error(f"AI response error: {result}")
+                json=payload,
+                stream=True
+            ) as response:
+                if response.ok:
+                    st.write_stream(stream_completion(response))
+                else:
+                    st.error(f"AI response error: {response.text}")
 
         except Exception as e:
             st.error(f"AI request failed: {e}")